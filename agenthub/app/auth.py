@@ -1,5 +1,5 @@
+import hashlib
 import os
-import secrets
 
 from fastapi import HTTPException, Security, status
 from fastapi.security import APIKeyHeader
@@ -7,12 +7,24 @@ from fastapi.security import APIKeyHeader
 API_KEY_HEADER = APIKeyHeader(name="X-API-Key", auto_error=False)
 
 
+def load_api_key_digests() -> frozenset[bytes]:
+    # AGENTHUB_API_KEYS (comma-separated) issues one key per client; AGENTHUB_API_KEY stays supported.
+    keys = [key.strip() for key in os.getenv("AGENTHUB_API_KEYS", "").split(",")]
+    single_key = os.getenv("AGENTHUB_API_KEY")
+    if single_key or not any(keys):
+        keys.append(single_key or "dev-secret-key")
+    return frozenset(hashlib.sha256(key.encode()).digest() for key in keys if key)
+
+
+# Read once at import. Presented keys are hashed before lookup, so timing never depends
+# on how many leading characters match a real key.
+API_KEY_DIGESTS = load_api_key_digests()
+
+
 def get_api_key(api_key: str | None = Security(API_KEY_HEADER)) -> str:
-    expected = os.getenv("AGENTHUB_API_KEY", "dev-secret-key")
-    if not api_key or not secrets.compare_digest(api_key, expected):
+    if not api_key or hashlib.sha256(api_key.encode()).digest() not in API_KEY_DIGESTS:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid or missing API key.",
         )
     return api_key
-
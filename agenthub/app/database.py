@@ -1,22 +1,67 @@
 import os
-from typing import Generator
+from functools import lru_cache
+from typing import Any, Generator
 
-from sqlalchemy import create_engine
+from fastapi import Depends, Request
+from sqlalchemy import Engine, create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from sqlalchemy.pool import StaticPool
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./agenthub.db")
 
-connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
-engine = create_engine(DATABASE_URL, connect_args=connect_args, future=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, future=True)
+
+def engine_options(database_url: str) -> dict[str, Any]:
+    url = make_url(database_url)
+    if url.get_backend_name() == "sqlite":
+        options: dict[str, Any] = {"connect_args": {"check_same_thread": False}}
+        if url.database in (None, "", ":memory:"):
+            # In-memory databases live and die with their connection, so share exactly one.
+            options["poolclass"] = StaticPool
+        # File databases keep SQLAlchemy's default QueuePool.
+        return options
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "20")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        "pool_timeout": 30,
+        "pool_pre_ping": True,
+        "pool_recycle": 3600,
+    }
+
+
+def set_sqlite_pragmas(dbapi_connection: Any, _: Any) -> None:
+    # WAL lets readers run alongside a writer; NORMAL skips per-commit fsync yet stays crash-safe in WAL.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.close()
+
+
+@lru_cache
+def create_db_engine() -> Engine:
+    # Built lazily and once per process; the app lifespan stores it on app.state.
+    engine = create_engine(DATABASE_URL, future=True, **engine_options(DATABASE_URL))
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", set_sqlite_pragmas)
+    return engine
+
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, future=True)
 
 Base = declarative_base()
 
 
-def get_db() -> Generator[Session, None, None]:
-    db = SessionLocal()
+async def get_engine(request: Request) -> Engine:
+    # async so resolving an already-built engine never takes a threadpool hop.
+    return request.app.state.engine
+
+
+def get_db(engine: Engine = Depends(get_engine)) -> Generator[Session, None, None]:
+    db = SessionLocal(bind=engine)
     try:
         yield db
     finally:
         db.close()
-
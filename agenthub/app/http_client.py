@@ -0,0 +1,19 @@
+import httpx
+from fastapi import Request
+
+
+def create_http_client() -> httpx.AsyncClient:
+    # Timeouts are set per request from each agent's max_latency_ms. HTTP/2 is negotiated
+    # over TLS where the upstream supports it, multiplexing concurrent calls on one connection.
+    return httpx.AsyncClient(
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=0,
+            limits=httpx.Limits(max_keepalive_connections=100, max_connections=500),
+        ),
+        timeout=None,
+    )
+
+
+async def get_http_client(request: Request) -> httpx.AsyncClient:
+    return request.app.state.http_client
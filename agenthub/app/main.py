@@ -1,42 +1,100 @@
+import hashlib
+import os
+import re
 from pathlib import Path
 from contextlib import asynccontextmanager
 
-from fastapi import APIRouter, FastAPI
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, FastAPI, Request, Response, status
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.types import Scope
 
-from .database import Base, engine
+from . import rate_limit
+from .database import Base, create_db_engine
+from .http_client import create_http_client
+from .migrations import upgrade_schema
 from .routers import agents
 
 
+# Content-hashed names such as app.3f9a1c2b.js can never change, so only they are cached forever.
+FINGERPRINTED_NAME = re.compile(r"\.[0-9a-f]{8,}\.[A-Za-z0-9]+$")
+
+
+def weak_etag(etag: str) -> str:
+    # GZipMiddleware may re-encode the body, so validators only promise semantic equivalence.
+    return etag if etag.startswith("W/") else f"W/{etag}"
+
+
+class CachedStaticFiles(StaticFiles):
+    def file_response(
+        self,
+        full_path: str | os.PathLike[str],
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if FINGERPRINTED_NAME.search(os.path.basename(full_path)):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            response.headers["Cache-Control"] = "public, no-cache"
+        if "etag" in response.headers:
+            response.headers["ETag"] = weak_etag(response.headers["etag"])
+        return response
+
+
 @asynccontextmanager
-async def lifespan(_: FastAPI):
+async def lifespan(app: FastAPI):
+    # An engine already placed on app.state (e.g. by an embedding app or tests) takes precedence.
+    engine = getattr(app.state, "engine", None) or create_db_engine()
+    app.state.engine = engine
     Base.metadata.create_all(bind=engine)
-    yield
+    upgrade_schema(engine)
+    app.state.index_html = (STATIC_DIR / "index.html").read_bytes()
+    app.state.index_etag = weak_etag(f'"{hashlib.sha256(app.state.index_html).hexdigest()}"')
+    async with create_http_client() as http_client:
+        app.state.http_client = http_client
+        yield
+    await rate_limit.rate_limiter.close()
 
 
 app = FastAPI(
     title="AgentHub API",
     version="0.1.0",
     description="MVP Agent-to-Agent Marketplace API",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan,
 )
+# Small payloads such as /health are not worth the compression CPU.
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 BASE_DIR = Path(__file__).resolve().parent
 STATIC_DIR = BASE_DIR / "static"
 api_v1_router = APIRouter(prefix="/api/v1")
 api_v1_router.include_router(agents.router)
 
-@app.get("/health", include_in_schema=False)
-@api_v1_router.get("/health", tags=["health"])
-def health() -> dict[str, str]:
-    return {"status": "ok"}
+# Pre-rendered once: health probes skip validation, serialization and the threadpool.
+HEALTH_RESPONSE = Response(content=b'{"status":"ok"}', media_type="application/json")
+
+
+@app.get("/health", include_in_schema=False, response_class=Response)
+@api_v1_router.get("/health", tags=["health"], response_class=Response)
+async def health() -> Response:
+    return HEALTH_RESPONSE
 
 
 @app.get("/", include_in_schema=False)
-def landing_page() -> FileResponse:
-    return FileResponse(STATIC_DIR / "index.html")
+async def landing_page(request: Request) -> Response:
+    etag = request.app.state.index_etag
+    # HTML is revalidated on every load (no-cache) but only re-sent when it changed.
+    headers = {"Cache-Control": "public, no-cache", "ETag": etag}
+    if_none_match = request.headers.get("if-none-match", "")
+    # If-None-Match uses weak comparison: only the opaque tags have to match.
+    if etag.removeprefix("W/") in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=request.app.state.index_html, media_type="text/html", headers=headers)
 
 
-app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+app.mount("/static", CachedStaticFiles(directory=STATIC_DIR), name="static")
 app.include_router(api_v1_router)
@@ -0,0 +1,48 @@
+from sqlalchemy import Engine, func, inspect, select, update
+
+from .models import Agent, CallLog
+
+# Columns added after the first release; create_all never alters existing tables.
+AGENT_COLUMN_DDL = {
+    "latency_sample_count": "INTEGER NOT NULL DEFAULT 0",
+    "total_latency_ms": "FLOAT NOT NULL DEFAULT 0",
+}
+# Indexes replaced by ix_agent_rank: the first release's single-column ones and the
+# earlier ix_agent_search, whose key order did not match the search ORDER BY.
+SUPERSEDED_AGENT_INDEXES = ("ix_agents_reputation_score", "ix_agents_price_per_call", "ix_agent_search")
+
+
+def upgrade_schema(engine: Engine) -> None:
+    add_agent_columns(engine)
+    sync_agent_indexes(engine)
+
+
+def add_agent_columns(engine: Engine) -> None:
+    table = Agent.__tablename__
+    existing = {column["name"] for column in inspect(engine).get_columns(table)}
+    missing = [name for name in AGENT_COLUMN_DDL if name not in existing]
+    if not missing:
+        return
+
+    with engine.begin() as connection:
+        for name in missing:
+            connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {name} {AGENT_COLUMN_DDL[name]}")
+        if "latency_sample_count" in missing:
+            latency_samples = (
+                select(func.count())
+                .where(CallLog.agent_id == Agent.id, CallLog.latency_ms.is_not(None))
+                .scalar_subquery()
+            )
+            connection.execute(update(Agent).values(latency_sample_count=latency_samples))
+        if "total_latency_ms" in missing:
+            connection.execute(update(Agent).values(total_latency_ms=Agent.avg_latency * Agent.latency_sample_count))
+
+
+def sync_agent_indexes(engine: Engine) -> None:
+    existing = {index["name"] for index in inspect(engine).get_indexes(Agent.__tablename__)}
+    with engine.begin() as connection:
+        for name in SUPERSEDED_AGENT_INDEXES:
+            if name in existing:
+                connection.exec_driver_sql(f"DROP INDEX {name}")
+        for index in Agent.__table__.indexes:
+            index.create(connection, checkfirst=True)
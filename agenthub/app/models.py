@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import JSON, Boolean, DateTime, Float, ForeignKey, Integer, String, Text
+from sqlalchemy import JSON, Boolean, DateTime, Float, ForeignKey, Index, Integer, String, Text, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .database import Base
@@ -15,24 +15,36 @@ class Agent(Base):
     input_schema: Mapped[dict] = mapped_column(JSON, nullable=False)
     output_schema: Mapped[dict] = mapped_column(JSON, nullable=False)
     endpoint: Mapped[str] = mapped_column(String(500), nullable=False)
-    price_per_call: Mapped[float] = mapped_column(Float, nullable=False, index=True)
+    price_per_call: Mapped[float] = mapped_column(Float, nullable=False)
     max_latency_ms: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
     total_calls: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
     successful_calls: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
     failed_calls: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
     avg_latency: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
-    reputation_score: Mapped[float] = mapped_column(Float, nullable=False, default=0.0, index=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    total_latency_ms: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    latency_sample_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    reputation_score: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    # default renders now() into the INSERT for tables created before server_default existed.
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=func.now(), server_default=func.now(), nullable=False
+    )
 
     call_logs: Mapped[list["CallLog"]] = relationship(back_populates="agent", cascade="all, delete-orphan")
 
 
+# Matches the leading search ORDER BY keys (score desc, price asc) so ranking walks the index;
+# only ties on the CASE latency key and id still go through a small sort.
+Index("ix_agent_rank", Agent.reputation_score.desc(), Agent.price_per_call, Agent.avg_latency)
+
+
 class CallLog(Base):
     __tablename__ = "call_logs"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     agent_id: Mapped[int] = mapped_column(Integer, ForeignKey("agents.id"), index=True, nullable=False)
-    timestamp: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True, nullable=False)
+    timestamp: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=func.now(), server_default=func.now(), index=True, nullable=False
+    )
     latency_ms: Mapped[float | None] = mapped_column(Float, nullable=True)
     success: Mapped[bool] = mapped_column(Boolean, nullable=False)
     error_message: Mapped[str | None] = mapped_column(Text, nullable=True)
@@ -1,9 +1,9 @@
+import hashlib
 import os
 import time
-from collections import defaultdict, deque
-from threading import Lock
 
 from fastapi import Depends, HTTPException, status
+from redis import asyncio as redis_asyncio
 
 from .auth import get_api_key
 
@@ -12,36 +12,100 @@ class InMemoryRateLimiter:
     def __init__(self, max_requests: int, window_seconds: int) -> None:
         self.max_requests = max_requests
         self.window_seconds = window_seconds
-        self._store: dict[str, deque[float]] = defaultdict(deque)
-        self._lock = Lock()
+        # Token bucket per key: [tokens, last_refill], refilled lazily on access. allow() only
+        # runs on the event loop and never awaits mid-update, so no lock is needed.
+        self._buckets: dict[str, list[float]] = {}
 
-    def allow(self, key: str) -> tuple[bool, int]:
-        now = time.time()
-        with self._lock:
-            bucket = self._store[key]
-            while bucket and (now - bucket[0]) > self.window_seconds:
-                bucket.popleft()
+    async def allow(self, key: str) -> tuple[bool, int]:
+        now = time.monotonic()
+        capacity = float(self.max_requests)
+        refill_rate = capacity / self.window_seconds
+        bucket = self._buckets.setdefault(key, [capacity, now])
+        bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * refill_rate)
+        bucket[1] = now
 
-            if len(bucket) >= self.max_requests:
-                retry_after = max(1, int(self.window_seconds - (now - bucket[0])))
-                return False, retry_after
-
-            bucket.append(now)
+        if bucket[0] >= 1:
+            bucket[0] -= 1
             return True, 0
 
+        retry_after = int((1 - bucket[0]) / refill_rate) + 1
+        return False, retry_after
+
+    def clear(self) -> None:
+        self._buckets.clear()
+
+    async def close(self) -> None:
+        pass
+
+
+# KEYS[1] = bucket key; ARGV = {refill_rate, capacity, ttl_seconds}.
+# The clock is Redis's own TIME so skew between app replicas cannot over-refill a bucket.
+TOKEN_BUCKET_SCRIPT = """
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local refill_rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local state = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(state[1]) or capacity
+local last_refill = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - last_refill) * refill_rate)
+
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = math.floor((1 - tokens) / refill_rate) + 1
+end
+
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "ts", tostring(now))
+redis.call("EXPIRE", KEYS[1], ARGV[3])
+return {allowed, retry_after}
+"""
+
+
+class RedisRateLimiter:
+    def __init__(self, redis_client: redis_asyncio.Redis, max_requests: int, window_seconds: int) -> None:
+        self.max_requests = max_requests
+        self.window_seconds = window_seconds
+        self._redis = redis_client
+        # register_script loads once and calls via EVALSHA, reloading on NOSCRIPT.
+        self._token_bucket = self._redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def allow(self, key: str) -> tuple[bool, int]:
+        # Hash the key so raw API keys never end up in the Redis keyspace.
+        bucket_key = f"agenthub:ratelimit:{hashlib.sha256(key.encode()).hexdigest()}"
+        allowed, retry_after = await self._token_bucket(
+            keys=[bucket_key],
+            args=[self.max_requests / self.window_seconds, self.max_requests, self.window_seconds],
+        )
+        return bool(allowed), int(retry_after)
+
+    async def close(self) -> None:
+        # The client owns its pool (from_url), so this also disconnects pooled connections.
+        await self._redis.aclose()
 
-rate_limiter = InMemoryRateLimiter(
-    max_requests=int(os.getenv("RATE_LIMIT_MAX_REQUESTS", "120")),
-    window_seconds=int(os.getenv("RATE_LIMIT_WINDOW_SECONDS", "60")),
-)
 
+def build_rate_limiter() -> InMemoryRateLimiter | RedisRateLimiter:
+    max_requests = int(os.getenv("RATE_LIMIT_MAX_REQUESTS", "120"))
+    window_seconds = int(os.getenv("RATE_LIMIT_WINDOW_SECONDS", "60"))
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        redis_client = redis_asyncio.Redis.from_url(redis_url, max_connections=50)
+        return RedisRateLimiter(redis_client, max_requests=max_requests, window_seconds=window_seconds)
+    # Per-process state: only correct for a single worker, fine for local development.
+    return InMemoryRateLimiter(max_requests=max_requests, window_seconds=window_seconds)
 
-def enforce_rate_limit(api_key: str = Depends(get_api_key)) -> None:
-    allowed, retry_after = rate_limiter.allow(api_key)
+
+rate_limiter = build_rate_limiter()
+
+
+async def enforce_rate_limit(api_key: str = Depends(get_api_key)) -> None:
+    allowed, retry_after = await rate_limiter.allow(api_key)
     if not allowed:
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
             detail="Rate limit exceeded.",
             headers={"Retry-After": str(retry_after)},
         )
-
@@ -1,11 +1,19 @@
+import asyncio
+from threading import Lock
 from time import perf_counter
 
 import httpx
-from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
-from sqlalchemy import delete, func, select
+import orjson
+from cachetools import TTLCache
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Response, status
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import Select, case, cast, column, delete, exists, func, select
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Session
+from sqlalchemy.sql.elements import ColumnElement
 
 from ..database import get_db
+from ..http_client import get_http_client
 from ..models import Agent, CallLog
 from ..rate_limit import enforce_rate_limit
 from ..schemas import (
@@ -23,6 +31,16 @@ router = APIRouter(
     dependencies=[Depends(enforce_rate_limit)],
 )
 
+SEARCH_CACHE_TTL_SECONDS = 2
+# Rendered JSON bodies keyed by normalized search parameters.
+_search_cache: TTLCache = TTLCache(maxsize=1024, ttl=SEARCH_CACHE_TTL_SECONDS)
+_search_cache_lock = Lock()
+
+
+def invalidate_search_cache() -> None:
+    with _search_cache_lock:
+        _search_cache.clear()
+
 
 @router.post("/register", response_model=AgentResponse, status_code=status.HTTP_201_CREATED)
 def register_agent(payload: RegisterAgentRequest, db: Session = Depends(get_db)) -> Agent:
@@ -37,10 +55,46 @@ def register_agent(payload: RegisterAgentRequest, db: Session = Depends(get_db))
     )
     db.add(agent)
     db.commit()
+    invalidate_search_cache()
     db.refresh(agent)
     return agent
 
 
+def skill_filter(dialect_name: str, skill: str) -> ColumnElement[bool]:
+    if dialect_name == "postgresql":
+        return cast(Agent.skills, JSONB).contains([skill])
+    # SQLite: expand the JSON array with json_each and match any element.
+    return exists(select(1).select_from(func.json_each(Agent.skills)).where(column("value") == skill))
+
+
+# Project exactly the AgentResponse fields so search never hydrates full ORM objects.
+SEARCH_COLUMNS = [getattr(Agent, field_name) for field_name in AgentResponse.model_fields]
+
+
+def build_search_query(
+    dialect_name: str,
+    skill: str | None,
+    max_price: float | None,
+    min_score: float | None,
+) -> Select:
+    query = select(*SEARCH_COLUMNS)
+    if skill:
+        query = query.where(skill_filter(dialect_name, skill))
+    if max_price is not None:
+        query = query.where(Agent.price_per_call <= max_price)
+    if min_score is not None:
+        query = query.where(Agent.reputation_score >= min_score)
+
+    # Agents without latency samples (avg_latency == 0) rank last on the latency tiebreak.
+    latency_sort_value = case((Agent.avg_latency > 0, Agent.avg_latency), else_=float("inf"))
+    return query.order_by(
+        Agent.reputation_score.desc(),
+        Agent.price_per_call.asc(),
+        latency_sort_value.asc(),
+        Agent.id.asc(),
+    )
+
+
 @router.get("/search", response_model=list[AgentResponse])
 def search_agents(
     skill: str | None = Query(default=None),
@@ -49,111 +103,139 @@ def search_agents(
     limit: int = Query(default=100, ge=1, le=500),
     offset: int = Query(default=0, ge=0),
     db: Session = Depends(get_db),
-) -> list[Agent]:
-    agents = list(db.execute(select(Agent)).scalars().all())
+) -> Response:
+    # Results are per API key holder, so only the client (not shared caches) may reuse them.
+    headers = {"Cache-Control": f"private, max-age={SEARCH_CACHE_TTL_SECONDS}"}
     requested_skill = skill.strip() if skill else None
+    if requested_skill and requested_skill.lower() == "all":
+        requested_skill = None
 
-    if requested_skill and requested_skill.lower() != "all":
-        agents = [agent for agent in agents if requested_skill in (agent.skills or [])]
-    if max_price is not None:
-        agents = [agent for agent in agents if agent.price_per_call <= max_price]
-    if min_score is not None:
-        agents = [agent for agent in agents if agent.reputation_score >= min_score]
+    cache_key = (requested_skill, max_price, min_score, limit, offset)
+    with _search_cache_lock:
+        cached_body = _search_cache.get(cache_key)
+    if cached_body is not None:
+        return Response(content=cached_body, media_type="application/json", headers=headers)
 
-    def latency_sort_value(agent: Agent) -> float:
-        return agent.avg_latency if agent.avg_latency > 0 else float("inf")
+    query = build_search_query(db.get_bind().dialect.name, requested_skill, max_price, min_score)
+    rows = db.execute(query.limit(limit).offset(offset)).mappings().all()
+    # Columns already match the response model, so the rows are rendered without revalidation.
+    response = ORJSONResponse([dict(row) for row in rows], headers=headers)
+    with _search_cache_lock:
+        _search_cache[cache_key] = response.body
+    return response
 
-    agents.sort(
-        key=lambda agent: (
-            -agent.reputation_score,
-            agent.price_per_call,
-            latency_sort_value(agent),
-        )
-    )
-    return agents[offset : offset + limit]
+
+# The sync ORM helpers below run via asyncio.to_thread so call_agent never blocks the
+# event loop on the database; the session is only ever used by one thread at a time.
+def _load_call_target(db: Session, agent_id: int) -> tuple[str, int] | None:
+    agent = db.get(Agent, agent_id)
+    if not agent:
+        return None
+    target = (agent.endpoint, agent.max_latency_ms)
+    # End the read transaction so the pooled DB connection is not held while awaiting
+    # the upstream agent; the agent row is reloaded with fresh counters afterwards.
+    db.commit()
+    return target
+
+
+def _finalize_call(
+    db: Session,
+    agent_id: int,
+    success: bool,
+    latency_ms: float,
+    error_message: str | None = None,
+) -> None:
+    # Metric update and call log commit (or roll back) together in a single transaction.
+    with db.begin():
+        agent = db.get(Agent, agent_id)
+        if agent is None:
+            # Deleted while the upstream call was in flight; nothing left to record against.
+            return
+        apply_call_metrics(agent, success=success, latency_ms=latency_ms)
+        db.add(log_call(agent_id, success=success, latency_ms=latency_ms, error_message=error_message))
+    invalidate_search_cache()
+
+
+def _json_object_body(response: httpx.Response) -> bytes | None:
+    # The body is spliced into our envelope verbatim, so it must be a valid JSON object;
+    # orjson validates it without a Pydantic round-trip.
+    mime_type = response.headers.get("content-type", "").split(";", 1)[0].strip().lower()
+    if mime_type != "application/json" and not mime_type.endswith("+json"):
+        return None
+    body = response.content.strip()
+    if body[:1] != b"{" or body[-1:] != b"}":
+        return None
+    try:
+        parsed = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        return None
+    return body if isinstance(parsed, dict) else None
 
 
 @router.post("/call", response_model=CallAgentResponse)
-async def call_agent(payload: CallAgentRequest, db: Session = Depends(get_db)) -> CallAgentResponse:
-    agent = db.get(Agent, payload.agent_id)
-    if not agent:
+async def call_agent(
+    payload: CallAgentRequest,
+    db: Session = Depends(get_db),
+    http_client: httpx.AsyncClient = Depends(get_http_client),
+) -> Response:
+    target = await asyncio.to_thread(_load_call_target, db, payload.agent_id)
+    if target is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Agent not found.")
 
-    timeout_seconds = min(max(agent.max_latency_ms / 1000.0, 0.05), 30.0)
+    endpoint, max_latency_ms = target
+    timeout_seconds = min(max(max_latency_ms / 1000.0, 0.05), 30.0)
+    timeout = httpx.Timeout(connect=min(timeout_seconds, 1.0), read=timeout_seconds, write=1.0, pool=0.5)
     started = perf_counter()
-    latency_sample_count = db.scalar(
-        select(func.count()).select_from(CallLog).where(CallLog.agent_id == agent.id, CallLog.latency_ms.is_not(None))
-    ) or 0
 
+    upstream_response: httpx.Response | None = None
+    error_message: str | None = None
+    error_status = status.HTTP_502_BAD_GATEWAY
     try:
-        async with httpx.AsyncClient(timeout=timeout_seconds) as client:
-            upstream_response = await client.post(agent.endpoint, json=payload.payload)
-        latency_ms = (perf_counter() - started) * 1000
-
-        if upstream_response.status_code >= 400:
-            error_message = f"Agent returned HTTP {upstream_response.status_code}."
-            apply_call_metrics(
-                agent,
-                success=False,
-                latency_ms=latency_ms,
-                previous_latency_samples=latency_sample_count,
-            )
-            db.add(log_call(agent.id, success=False, latency_ms=latency_ms, error_message=error_message))
-            db.commit()
-            raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=error_message)
-
-        try:
-            result = upstream_response.json()
-        except ValueError:
-            error_message = "Agent returned a non-JSON response."
-            apply_call_metrics(
-                agent,
-                success=False,
-                latency_ms=latency_ms,
-                previous_latency_samples=latency_sample_count,
-            )
-            db.add(log_call(agent.id, success=False, latency_ms=latency_ms, error_message=error_message))
-            db.commit()
-            raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=error_message)
-
-        apply_call_metrics(
-            agent,
-            success=True,
-            latency_ms=latency_ms,
-            previous_latency_samples=latency_sample_count,
-        )
-        db.add(log_call(agent.id, success=True, latency_ms=latency_ms))
-        db.commit()
-        return CallAgentResponse(
-            agent_id=agent.id,
-            success=True,
-            latency_ms=latency_ms,
-            result=result,
-        )
+        upstream_response = await http_client.post(endpoint, json=payload.payload, timeout=timeout)
+    except httpx.PoolTimeout:
+        # Our own connection pool is exhausted; the agent was never contacted, so this
+        # must not be recorded against its reputation.
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Gateway is busy; retry the call.",
+        ) from None
     except httpx.TimeoutException:
-        latency_ms = (perf_counter() - started) * 1000
         error_message = "Agent call timed out."
-        apply_call_metrics(
-            agent,
-            success=False,
-            latency_ms=latency_ms,
-            previous_latency_samples=latency_sample_count,
-        )
-        db.add(log_call(agent.id, success=False, latency_ms=latency_ms, error_message=error_message))
-        db.commit()
-        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=error_message)
+        error_status = status.HTTP_504_GATEWAY_TIMEOUT
     except httpx.RequestError:
-        latency_ms = (perf_counter() - started) * 1000
         error_message = "Failed to reach agent endpoint."
-        apply_call_metrics(
-            agent,
-            success=False,
-            latency_ms=latency_ms,
-            previous_latency_samples=latency_sample_count,
-        )
-        db.add(log_call(agent.id, success=False, latency_ms=latency_ms, error_message=error_message))
-        db.commit()
-        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=error_message)
+    latency_ms = (perf_counter() - started) * 1000
+
+    result_body: bytes | None = None
+    if upstream_response is not None:
+        if upstream_response.status_code >= 400:
+            error_message = f"Agent returned HTTP {upstream_response.status_code}."
+        else:
+            result_body = _json_object_body(upstream_response)
+            if result_body is None:
+                error_message = "Agent returned a non-JSON response."
+
+    await asyncio.to_thread(
+        _finalize_call,
+        db,
+        payload.agent_id,
+        success=error_message is None,
+        latency_ms=latency_ms,
+        error_message=error_message,
+    )
+    if error_message is not None:
+        raise HTTPException(status_code=error_status, detail=error_message)
+    # Same shape as CallAgentResponse: the body orjson already validated is spliced in verbatim,
+    # skipping the Pydantic validation and re-encode round-trip.
+    return ORJSONResponse(
+        {
+            "agent_id": payload.agent_id,
+            "success": True,
+            "latency_ms": latency_ms,
+            "result": orjson.Fragment(result_body),
+            "error": None,
+        }
+    )
 
 
 @router.post("/report", response_model=AgentResponse)
@@ -165,10 +247,36 @@ def report_result(payload: ReportResultRequest, db: Session = Depends(get_db)) -
     apply_call_metrics(agent, success=payload.success, latency_ms=None)
     db.add(log_call(agent.id, success=payload.success, latency_ms=None, error_message=None))
     db.commit()
+    invalidate_search_cache()
     db.refresh(agent)
     return agent
 
 
+@router.post("/report:batch", response_model=list[AgentResponse])
+def report_results(
+    payload: list[ReportResultRequest] = Body(..., min_length=1, max_length=500),
+    db: Session = Depends(get_db),
+) -> list[Agent]:
+    agent_ids = list(dict.fromkeys(report.agent_id for report in payload))
+    agents = {agent.id: agent for agent in db.scalars(select(Agent).where(Agent.id.in_(agent_ids)))}
+    if len(agents) != len(agent_ids):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Agent not found.")
+
+    # Repeated agent ids accumulate on the same identity-mapped row; the flush then
+    # writes each agent once and all logs in a single transaction.
+    for report in payload:
+        apply_call_metrics(agents[report.agent_id], success=report.success, latency_ms=None)
+    db.add_all(log_call(report.agent_id, success=report.success) for report in payload)
+    db.commit()
+    invalidate_search_cache()
+    # The commit expired every agent; reload them in one query instead of one lazy SELECT each.
+    reloaded = db.scalars(
+        select(Agent).where(Agent.id.in_(agent_ids)).execution_options(populate_existing=True)
+    )
+    agents = {agent.id: agent for agent in reloaded}
+    return [agents[agent_id] for agent_id in agent_ids]
+
+
 @router.delete("/{agent_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_agent(agent_id: int, db: Session = Depends(get_db)) -> Response:
     agent = db.get(Agent, agent_id)
@@ -179,4 +287,5 @@ def delete_agent(agent_id: int, db: Session = Depends(get_db)) -> Response:
     db.execute(delete(CallLog).where(CallLog.agent_id == agent.id))
     db.delete(agent)
     db.commit()
+    invalidate_search_cache()
     return Response(status_code=status.HTTP_204_NO_CONTENT)
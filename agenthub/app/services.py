@@ -12,9 +12,7 @@ def apply_call_metrics(
     agent: models.Agent,
     success: bool,
     latency_ms: float | None = None,
-    previous_latency_samples: int | None = None,
 ) -> None:
-    previous_total = agent.total_calls
     agent.total_calls += 1
     if success:
         agent.successful_calls += 1
@@ -22,11 +20,11 @@ def apply_call_metrics(
         agent.failed_calls += 1
 
     if latency_ms is not None:
-        samples = previous_latency_samples if previous_latency_samples is not None else previous_total
-        if samples <= 0:
-            agent.avg_latency = latency_ms
-        else:
-            agent.avg_latency = ((agent.avg_latency * samples) + latency_ms) / (samples + 1)
+        # Keep the exact sum so the average never drifts; avg_latency stays a stored
+        # column because search ranks and indexes on it.
+        agent.total_latency_ms += latency_ms
+        agent.latency_sample_count += 1
+        agent.avg_latency = agent.total_latency_ms / agent.latency_sample_count
 
     update_reputation(agent)
 
@@ -5,23 +5,26 @@ from pydantic import BaseModel, Field
 
 app = FastAPI(title="KeywordExtractAgent", version="0.1.0")
 
-STOP_WORDS = {
-    "the",
-    "a",
-    "an",
-    "and",
-    "or",
-    "to",
-    "of",
-    "in",
-    "is",
-    "it",
-    "for",
-    "on",
-    "with",
-    "this",
-    "that",
-}
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOP_WORDS = frozenset(
+    {
+        "the",
+        "a",
+        "an",
+        "and",
+        "or",
+        "to",
+        "of",
+        "in",
+        "is",
+        "it",
+        "for",
+        "on",
+        "with",
+        "this",
+        "that",
+    }
+)
 
 
 class KeywordRequest(BaseModel):
@@ -30,15 +33,13 @@ class KeywordRequest(BaseModel):
 
 @app.post("/run")
 def run(payload: KeywordRequest) -> dict[str, list[str]]:
-    tokens = re.findall(r"[a-zA-Z0-9]+", payload.text.lower())
-    keywords: list[str] = []
-    seen: set[str] = set()
-    for token in tokens:
-        if token in STOP_WORDS or token in seen or len(token) < 3:
+    # Insertion-ordered dict dedupes while keeping first-seen order; finditer stops early.
+    keywords: dict[str, None] = {}
+    for match in TOKEN_PATTERN.finditer(payload.text.lower()):
+        token = match.group()
+        if len(token) < 3 or token in STOP_WORDS:
             continue
-        keywords.append(token)
-        seen.add(token)
+        keywords[token] = None
         if len(keywords) == 8:
             break
-    return {"keywords": keywords}
-
+    return {"keywords": list(keywords)}
@@ -2,19 +2,55 @@
 
 from __future__ import annotations
 
-from pathlib import Path
+import asyncio
+from collections.abc import Callable, Iterator, Mapping
+from dataclasses import dataclass, field
+from types import MappingProxyType
 from typing import Any
 
 import httpx
+import orjson
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine, select
+from sqlalchemy import Connection, Engine, create_engine, event, func, inspect, select
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
+from agenthub.app import auth
 from agenthub.app import main as app_main
+from agenthub.app import rate_limit
 from agenthub.app.database import Base, get_db
+from agenthub.app.migrations import upgrade_schema
 from agenthub.app.models import Agent, CallLog
-from agenthub.app.rate_limit import InMemoryRateLimiter
+from agenthub.app.routers.agents import build_search_query, invalidate_search_cache
+
+
+@dataclass
+class _StubResponse:
+    """Duck-typed stand-in for httpx.Response exposing only what /call reads."""
+
+    status_code: int
+    content: bytes
+    headers: dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def from_json(cls, status_code: int, body: dict[str, Any]) -> _StubResponse:
+        return cls(status_code, orjson.dumps(body), {"content-type": "application/json"})
+
+
+UpstreamHandler = Callable[[dict[str, Any]], _StubResponse]
+
+_SAMPLE_PAYLOAD: Mapping[str, Any] = MappingProxyType(
+    {
+        "name": "SummarizeAgent",
+        "skills": ("summarize_text",),
+        "input_schema": {"text": "string"},
+        "output_schema": {"summary": "string"},
+        "price_per_call": 0.001,
+        "endpoint": "http://127.0.0.1:9001/run",
+        "max_latency_ms": 500,
+    }
+)
 
 
 @pytest.fixture
@@ -22,6 +58,7 @@ def api_key(monkeypatch: pytest.MonkeyPatch) -> str:
     """Use a test-only API key for all protected endpoints."""
     key = "test-api-key"
     monkeypatch.setenv("AGENTHUB_API_KEY", key)
+    monkeypatch.setattr(auth, "API_KEY_DIGESTS", auth.load_api_key_digests())
     return key
 
 
@@ -31,41 +68,134 @@ def auth_headers(api_key: str) -> dict[str, str]:
     return {"X-API-Key": api_key}
 
 
+def make_payload(**overrides: Any) -> dict[str, Any]:
+    """Build a fresh registration payload from the baseline, with per-test field overrides."""
+    return {
+        **_SAMPLE_PAYLOAD,
+        "skills": list(_SAMPLE_PAYLOAD["skills"]),
+        "input_schema": dict(_SAMPLE_PAYLOAD["input_schema"]),
+        "output_schema": dict(_SAMPLE_PAYLOAD["output_schema"]),
+        **overrides,
+    }
+
+
 @pytest.fixture
 def sample_agent_payload() -> dict[str, Any]:
     """Baseline payload for registering agents."""
-    return {
-        "name": "SummarizeAgent",
-        "skills": ["summarize_text"],
-        "input_schema": {"text": "string"},
-        "output_schema": {"summary": "string"},
-        "price_per_call": 0.001,
-        "endpoint": "http://127.0.0.1:9001/run",
-        "max_latency_ms": 500,
-    }
+    return make_payload()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def httpx_routes() -> Iterator[dict[str, UpstreamHandler]]:
+    """Patch AsyncClient.post once per session so no test reaches the network; dispatch by URL."""
+    routes: dict[str, UpstreamHandler] = {}
+
+    async def fake_post(self, url: str, json: dict[str, Any], **kwargs: Any):  # noqa: ANN001
+        handler = routes.get(str(url))
+        if handler is None:
+            raise httpx.ConnectError(f"No mocked upstream for {url}.")
+        return handler(json)
+
+    with pytest.MonkeyPatch.context() as session_patch:
+        session_patch.setattr(httpx.AsyncClient, "post", fake_post)
+        yield routes
 
 
 @pytest.fixture
-def db_setup(tmp_path: Path) -> tuple[sessionmaker, Any]:
-    """Create a fresh SQLite database per test to keep tests independent."""
-    db_file = tmp_path / "test.db"
-    engine = create_engine(f"sqlite:///{db_file}", connect_args={"check_same_thread": False}, future=True)
-    TestingSessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False, future=True)
+def mock_httpx(httpx_routes: dict[str, UpstreamHandler]) -> Iterator[dict[str, UpstreamHandler]]:
+    """Per-test upstream routes: map an agent endpoint to a handler receiving the JSON payload."""
+    try:
+        yield httpx_routes
+    finally:
+        httpx_routes.clear()
+
+
+@pytest.fixture(scope="session")
+def db_engine(request: pytest.FixtureRequest) -> Iterator[Engine]:
+    """Build one in-memory SQLite database and its schema for the whole test session."""
+    # Name the database after the pytest-xdist worker (if any) so parallel runs never share one.
+    worker_id = getattr(request.config, "workerinput", {}).get("workerid", "main")
+    # StaticPool hands every checkout the same connection, which is what keeps an
+    # in-memory database alive and visible across TestClient's threads.
+    engine = create_engine(
+        f"sqlite:///file:agenthub_test_{worker_id}?mode=memory&cache=shared&uri=true",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+        future=True,
+    )
+
+    # pysqlite defers BEGIN until the first write, which breaks SAVEPOINT nesting;
+    # take over transaction control so each test's outer transaction is real.
+    @event.listens_for(engine, "connect")
+    def disable_pysqlite_transactions(dbapi_connection: Any, _: Any) -> None:
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def emit_begin(connection: Connection) -> None:
+        connection.exec_driver_sql("BEGIN")
+
     Base.metadata.create_all(bind=engine)
     try:
-        yield TestingSessionLocal, engine
+        yield engine
     finally:
-        Base.metadata.drop_all(bind=engine)
         engine.dispose()
 
 
+@pytest.fixture
+def db_setup(db_engine: Engine) -> Iterator[tuple[sessionmaker, Connection]]:
+    """Run each test inside an outer transaction that is rolled back to keep tests independent.
+
+    Sessions join that transaction through SAVEPOINTs, so their commits stay invisible
+    to other tests.
+    """
+    connection = db_engine.connect()
+    transaction = connection.begin()
+    TestingSessionLocal = sessionmaker(
+        bind=connection,
+        autocommit=False,
+        autoflush=False,
+        future=True,
+        join_transaction_mode="create_savepoint",
+    )
+    try:
+        yield TestingSessionLocal, connection
+    finally:
+        transaction.rollback()
+        connection.close()
+
+
+@pytest.fixture(scope="session")
+def in_memory_rate_limiter() -> Iterator[rate_limit.InMemoryRateLimiter]:
+    """Pin the app to the in-memory limiter even when REDIS_URL is exported."""
+    limiter = rate_limit.InMemoryRateLimiter(max_requests=1000, window_seconds=60)
+    with pytest.MonkeyPatch.context() as session_patch:
+        session_patch.setattr(rate_limit, "rate_limiter", limiter)
+        yield limiter
+
+
+@pytest.fixture(scope="session")
+def app_client(
+    db_engine: Engine,
+    in_memory_rate_limiter: rate_limit.InMemoryRateLimiter,
+) -> Iterator[TestClient]:
+    """Start the app and run its lifespan once for the whole session."""
+    # The lifespan uses an engine already on app.state, so startup never touches the configured database.
+    app_main.app.state.engine = db_engine
+    try:
+        with TestClient(app_main.app) as test_client:
+            yield test_client
+    finally:
+        del app_main.app.state.engine
+
+
 @pytest.fixture
 def client(
-    db_setup: tuple[sessionmaker, Any],
-    monkeypatch: pytest.MonkeyPatch,
-) -> TestClient:
+    app_client: TestClient,
+    db_setup: tuple[sessionmaker, Connection],
+    in_memory_rate_limiter: rate_limit.InMemoryRateLimiter,
+) -> Iterator[TestClient]:
     """Wire FastAPI dependency overrides to the isolated test database."""
-    db_session_factory, test_engine = db_setup
+    db_session_factory, _ = db_setup
 
     def override_get_db():
         db = db_session_factory()
@@ -74,48 +204,97 @@ def client(
         finally:
             db.close()
 
-    # Ensure startup table creation (if triggered) uses this test DB engine.
-    monkeypatch.setattr(app_main, "engine", test_engine)
-
     # Reset global rate limiter state for each test.
-    monkeypatch.setattr(
-        "agenthub.app.rate_limit.rate_limiter",
-        InMemoryRateLimiter(max_requests=1000, window_seconds=60),
-    )
+    in_memory_rate_limiter.clear()
+    in_memory_rate_limiter.max_requests = 1000
+    in_memory_rate_limiter.window_seconds = 60
+
+    # Search results are cached in-process; never leak them across test databases.
+    invalidate_search_cache()
 
     app_main.app.dependency_overrides[get_db] = override_get_db
     try:
-        with TestClient(app_main.app) as test_client:
-            yield test_client
+        yield app_client
     finally:
-        app_main.app.dependency_overrides.clear()
+        app_main.app.dependency_overrides.pop(get_db, None)
+
+
+class AuthedClient:
+    """TestClient wrapper that sends the test API key with every request."""
+
+    def __init__(self, client: TestClient, headers: dict[str, str]) -> None:
+        self._client = client
+        self._headers = headers
+
+    def _with_auth(self, kwargs: dict[str, Any]) -> dict[str, Any]:
+        kwargs["headers"] = {**self._headers, **kwargs.get("headers", {})}
+        return kwargs
 
+    def get(self, url: str, **kwargs: Any) -> httpx.Response:
+        return self._client.get(url, **self._with_auth(kwargs))
+
+    def post(self, url: str, **kwargs: Any) -> httpx.Response:
+        return self._client.post(url, **self._with_auth(kwargs))
+
+    def delete(self, url: str, **kwargs: Any) -> httpx.Response:
+        return self._client.delete(url, **self._with_auth(kwargs))
+
+
+@pytest.fixture
+def authed_client(client: TestClient, auth_headers: dict[str, str]) -> AuthedClient:
+    """Client for protected endpoints; the API key header is injected automatically."""
+    return AuthedClient(client, auth_headers)
 
-def register_agent(client: TestClient, headers: dict[str, str], payload: dict[str, Any]) -> dict[str, Any]:
+
+def register_agent(client: AuthedClient, payload: dict[str, Any]) -> dict[str, Any]:
     """Helper for concise agent registration inside tests."""
-    response = client.post("/api/v1/agents/register", headers=headers, json=payload)
+    response = client.post("/api/v1/agents/register", json=payload)
     assert response.status_code == 201
     return response.json()
 
 
-def test_health_endpoints_available(client: TestClient) -> None:
+@pytest.mark.parametrize("path", ["/health", "/api/v1/health"])
+def test_health_endpoint_available(client: TestClient, path: str) -> None:
     """Both operational and versioned health checks should return 200."""
-    operational = client.get("/health")
-    versioned = client.get("/api/v1/health")
+    response = client.get(path)
+
+    assert response.status_code == 200
+    assert response.json() == {"status": "ok"}
+
+
+def test_landing_page_revalidates_with_etag(client: TestClient) -> None:
+    """Landing page should carry an ETag and answer a matching If-None-Match with 304."""
+    first = client.get("/")
+    assert first.status_code == 200
+    assert first.headers["content-type"].startswith("text/html")
+    assert first.headers["cache-control"] == "public, no-cache"
+    etag = first.headers["etag"]
+    assert etag.startswith("W/")
 
-    assert operational.status_code == 200
-    assert operational.json() == {"status": "ok"}
-    assert versioned.status_code == 200
-    assert versioned.json() == {"status": "ok"}
+    revalidated = client.get("/", headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+
+
+def test_static_html_is_revalidated_not_immutable(client: TestClient) -> None:
+    """Unfingerprinted static files must revalidate and carry a weak ETag, since gzip may re-encode them."""
+    first = client.get("/static/index.html")
+    assert first.status_code == 200
+    assert first.headers["cache-control"] == "public, no-cache"
+    etag = first.headers["etag"]
+    assert etag.startswith("W/")
+
+    revalidated = client.get("/static/index.html", headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.headers["etag"] == etag
 
 
 def test_register_agent_success(
-    client: TestClient,
-    auth_headers: dict[str, str],
+    authed_client: AuthedClient,
     sample_agent_payload: dict[str, Any],
 ) -> None:
     """Registering a valid agent should persist it with default metrics."""
-    response = client.post("/api/v1/agents/register", headers=auth_headers, json=sample_agent_payload)
+    response = authed_client.post("/api/v1/agents/register", json=sample_agent_payload)
 
     assert response.status_code == 201
     body = response.json()
@@ -129,72 +308,70 @@ def test_register_agent_success(
     assert body["reputation_score"] == 0.0
 
 
-def test_register_agent_validation_error(
-    client: TestClient,
-    auth_headers: dict[str, str],
-    sample_agent_payload: dict[str, Any],
-) -> None:
+def test_register_agent_validation_error(authed_client: AuthedClient) -> None:
     """Missing required fields should return validation errors."""
-    invalid_payload = dict(sample_agent_payload)
-    invalid_payload.pop("endpoint")
+    invalid_payload = make_payload()
+    del invalid_payload["endpoint"]
 
-    response = client.post("/api/v1/agents/register", headers=auth_headers, json=invalid_payload)
+    response = authed_client.post("/api/v1/agents/register", json=invalid_payload)
     assert response.status_code == 422
 
 
+def assert_search_uses_rank_index(connection: Connection) -> None:
+    """Explain the filtered search query on ``connection`` and require it to walk ix_agent_rank."""
+    query = build_search_query("sqlite", "summarize_text", 0.01, 0.8).limit(100).offset(0)
+    compiled = query.compile(dialect=connection.dialect)
+    plan = [
+        row.detail
+        for row in connection.exec_driver_sql(
+            f"EXPLAIN QUERY PLAN {compiled}", tuple(compiled.params[name] for name in compiled.positiontup)
+        )
+    ]
+    assert any("USING INDEX ix_agent_rank" in step for step in plan)
+    assert "USE TEMP B-TREE FOR ORDER BY" not in plan
+
+
 def test_search_agents_filters_and_ranking(
-    client: TestClient,
-    auth_headers: dict[str, str],
+    authed_client: AuthedClient,
     db_setup: tuple[sessionmaker, Any],
-    sample_agent_payload: dict[str, Any],
 ) -> None:
     """Search should apply filters and rank by score desc, then price asc, then latency asc."""
-    payload_a = dict(sample_agent_payload)
-    payload_a["name"] = "A"
-    payload_a["price_per_call"] = 0.002
-    a = register_agent(client, auth_headers, payload_a)
-
-    payload_b = dict(sample_agent_payload)
-    payload_b["name"] = "B"
-    payload_b["price_per_call"] = 0.001
-    b = register_agent(client, auth_headers, payload_b)
-
-    payload_c = dict(sample_agent_payload)
-    payload_c["name"] = "C"
-    payload_c["skills"] = ["translate_text"]
-    payload_c["price_per_call"] = 0.0005
-    c = register_agent(client, auth_headers, payload_c)
-
-    # Manually set metrics so ranking order is deterministic.
+    # Seed agents with fixed metrics directly so ranking order is deterministic;
+    # registration itself is covered by the register tests.
     db_session_factory, _ = db_setup
     with db_session_factory() as db:
-        agent_a = db.get(Agent, a["id"])
-        agent_b = db.get(Agent, b["id"])
-        agent_c = db.get(Agent, c["id"])
-        assert agent_a and agent_b and agent_c
-
-        agent_a.total_calls = 10
-        agent_a.successful_calls = 9
-        agent_a.failed_calls = 1
-        agent_a.reputation_score = 0.9
-        agent_a.avg_latency = 250.0
-
-        agent_b.total_calls = 10
-        agent_b.successful_calls = 9
-        agent_b.failed_calls = 1
-        agent_b.reputation_score = 0.9
-        agent_b.avg_latency = 300.0
-
-        agent_c.total_calls = 10
-        agent_c.successful_calls = 8
-        agent_c.failed_calls = 2
-        agent_c.reputation_score = 0.8
-        agent_c.avg_latency = 100.0
+        db.add_all(
+            [
+                Agent(
+                    **make_payload(name="A", price_per_call=0.002),
+                    total_calls=10,
+                    successful_calls=9,
+                    failed_calls=1,
+                    reputation_score=0.9,
+                    avg_latency=250.0,
+                ),
+                Agent(
+                    **make_payload(name="B", price_per_call=0.001),
+                    total_calls=10,
+                    successful_calls=9,
+                    failed_calls=1,
+                    reputation_score=0.9,
+                    avg_latency=300.0,
+                ),
+                Agent(
+                    **make_payload(name="C", skills=["translate_text"], price_per_call=0.0005),
+                    total_calls=10,
+                    successful_calls=8,
+                    failed_calls=2,
+                    reputation_score=0.8,
+                    avg_latency=100.0,
+                ),
+            ]
+        )
         db.commit()
 
-    response = client.get(
+    response = authed_client.get(
         "/api/v1/agents/search",
-        headers=auth_headers,
         params={"skill": "summarize_text", "max_price": 0.01, "min_score": 0.8},
     )
     assert response.status_code == 200
@@ -202,28 +379,45 @@ def test_search_agents_filters_and_ranking(
 
     # A and B have same score; B should come first because lower price.
     assert [agent["name"] for agent in body] == ["B", "A"]
+    # Ranking walks the composite index on the test database; only the right part of the
+    # ORDER BY (CASE latency key, id) still needs a temp b-tree.
+    _, connection = db_setup
+    assert_search_uses_rank_index(connection)
+
+
+def test_search_cache_invalidated_on_register(
+    authed_client: AuthedClient,
+    sample_agent_payload: dict[str, Any],
+) -> None:
+    """Cached search results should be dropped as soon as a new agent registers."""
+    empty = authed_client.get("/api/v1/agents/search", params={"skill": "summarize_text"})
+    assert empty.status_code == 200
+    assert empty.json() == []
+    assert empty.headers["cache-control"] == "private, max-age=2"
+
+    registered = register_agent(authed_client, sample_agent_payload)
+
+    refreshed = authed_client.get("/api/v1/agents/search", params={"skill": "summarize_text"})
+    assert [agent["id"] for agent in refreshed.json()] == [registered["id"]]
 
 
 def test_call_agent_success_updates_metrics_and_logs(
-    client: TestClient,
-    auth_headers: dict[str, str],
+    authed_client: AuthedClient,
     db_setup: tuple[sessionmaker, Any],
     sample_agent_payload: dict[str, Any],
-    monkeypatch: pytest.MonkeyPatch,
+    mock_httpx: dict[str, UpstreamHandler],
 ) -> None:
     """Proxy call success should return upstream output and update call statistics."""
-    registered = register_agent(client, auth_headers, sample_agent_payload)
+    registered = register_agent(authed_client, sample_agent_payload)
 
-    async def fake_post(self, url: str, json: dict[str, Any]):  # noqa: ANN001
-        assert url == sample_agent_payload["endpoint"]
+    def summarize(json: dict[str, Any]) -> _StubResponse:
         assert json == {"text": "hello world"}
-        return httpx.Response(status_code=200, json={"summary": "hello"})
+        return _StubResponse.from_json(200, {"summary": "hello"})
 
-    monkeypatch.setattr(httpx.AsyncClient, "post", fake_post)
+    mock_httpx[sample_agent_payload["endpoint"]] = summarize
 
-    response = client.post(
+    response = authed_client.post(
         "/api/v1/agents/call",
-        headers=auth_headers,
         json={"agent_id": registered["id"], "payload": {"text": "hello world"}},
     )
     assert response.status_code == 200
@@ -241,30 +435,33 @@ def test_call_agent_success_updates_metrics_and_logs(
         assert agent.failed_calls == 0
         assert agent.reputation_score == 1.0
         assert agent.avg_latency >= 0
+        assert agent.latency_sample_count == 1
+        assert agent.total_latency_ms == pytest.approx(agent.avg_latency)
 
-        logs = db.scalars(select(CallLog).where(CallLog.agent_id == registered["id"])).all()
-        assert len(logs) == 1
-        assert logs[0].success is True
+        log_count, success_count = db.execute(
+            select(func.count(), func.count().filter(CallLog.success.is_(True))).where(
+                CallLog.agent_id == registered["id"]
+            )
+        ).one()
+        assert (log_count, success_count) == (1, 1)
 
 
 def test_call_agent_timeout_failure_updates_metrics(
-    client: TestClient,
-    auth_headers: dict[str, str],
+    authed_client: AuthedClient,
     db_setup: tuple[sessionmaker, Any],
     sample_agent_payload: dict[str, Any],
-    monkeypatch: pytest.MonkeyPatch,
+    mock_httpx: dict[str, UpstreamHandler],
 ) -> None:
     """Timeouts from downstream agents should return 504 and count as failed calls."""
-    registered = register_agent(client, auth_headers, sample_agent_payload)
+    registered = register_agent(authed_client, sample_agent_payload)
 
-    async def fake_post(self, url: str, json: dict[str, Any]):  # noqa: ANN001
+    def time_out(json: dict[str, Any]) -> _StubResponse:
         raise httpx.TimeoutException("timed out")
 
-    monkeypatch.setattr(httpx.AsyncClient, "post", fake_post)
+    mock_httpx[sample_agent_payload["endpoint"]] = time_out
 
-    response = client.post(
+    response = authed_client.post(
         "/api/v1/agents/call",
-        headers=auth_headers,
         json={"agent_id": registered["id"], "payload": {"text": "hello world"}},
     )
     assert response.status_code == 504
@@ -280,59 +477,170 @@ def test_call_agent_timeout_failure_updates_metrics(
         assert agent.reputation_score == 0.0
 
 
-def test_call_agent_not_found_returns_404(client: TestClient, auth_headers: dict[str, str]) -> None:
-    """Calling an unknown agent id should return 404."""
-    response = client.post(
+def test_call_agent_pool_timeout_is_not_charged_to_agent(
+    authed_client: AuthedClient,
+    db_setup: tuple[sessionmaker, Any],
+    sample_agent_payload: dict[str, Any],
+    mock_httpx: dict[str, UpstreamHandler],
+) -> None:
+    """Exhausting the gateway's own connection pool should return 503 and leave agent metrics untouched."""
+    registered = register_agent(authed_client, sample_agent_payload)
+
+    def pool_exhausted(json: dict[str, Any]) -> _StubResponse:
+        raise httpx.PoolTimeout("no free connection")
+
+    mock_httpx[sample_agent_payload["endpoint"]] = pool_exhausted
+
+    response = authed_client.post(
         "/api/v1/agents/call",
-        headers=auth_headers,
-        json={"agent_id": 99999, "payload": {"text": "hello world"}},
+        json={"agent_id": registered["id"], "payload": {"text": "hello world"}},
     )
+    assert response.status_code == 503
+    assert response.json()["detail"] == "Gateway is busy; retry the call."
+
+    db_session_factory, _ = db_setup
+    with db_session_factory() as db:
+        agent = db.get(Agent, registered["id"])
+        assert agent is not None
+        assert agent.total_calls == 0
+        assert agent.failed_calls == 0
+        log_count = db.scalar(select(func.count()).select_from(CallLog).where(CallLog.agent_id == registered["id"]))
+        assert log_count == 0
+
+
+@pytest.mark.parametrize(
+    "upstream",
+    [
+        _StubResponse(200, b"summary: hello", {"content-type": "text/plain"}),
+        _StubResponse(200, b'{"a": 1}\n{"b": 2}', {"content-type": "application/json"}),
+    ],
+    ids=["plain-text", "brace-wrapped-invalid-json"],
+)
+def test_call_agent_non_json_response_is_rejected(
+    authed_client: AuthedClient,
+    db_setup: tuple[sessionmaker, Any],
+    sample_agent_payload: dict[str, Any],
+    mock_httpx: dict[str, UpstreamHandler],
+    upstream: _StubResponse,
+) -> None:
+    """Upstream bodies that are not valid JSON objects should return 502 and count as failures."""
+    registered = register_agent(authed_client, sample_agent_payload)
+
+    mock_httpx[sample_agent_payload["endpoint"]] = lambda json: upstream
+
+    response = authed_client.post(
+        "/api/v1/agents/call",
+        json={"agent_id": registered["id"], "payload": {"text": "hello world"}},
+    )
+    assert response.status_code == 502
+    assert response.json()["detail"] == "Agent returned a non-JSON response."
+
+    db_session_factory, _ = db_setup
+    with db_session_factory() as db:
+        agent = db.get(Agent, registered["id"])
+        assert agent is not None
+        assert agent.failed_calls == 1
+
+
+@pytest.mark.parametrize(
+    ("method", "path", "json"),
+    [
+        ("post", "/api/v1/agents/call", {"agent_id": 99999, "payload": {"text": "hello world"}}),
+        ("post", "/api/v1/agents/report:batch", [{"agent_id": 99999, "success": True}]),
+        ("delete", "/api/v1/agents/99999", None),
+    ],
+    ids=["call", "report-batch", "delete"],
+)
+def test_unknown_agent_returns_404(
+    authed_client: AuthedClient,
+    method: str,
+    path: str,
+    json: Any,
+) -> None:
+    """Endpoints addressing an unknown agent id should return 404."""
+    kwargs = {} if json is None else {"json": json}
+    response = getattr(authed_client, method)(path, **kwargs)
     assert response.status_code == 404
     assert response.json()["detail"] == "Agent not found."
 
 
 def test_report_result_updates_reputation(
-    client: TestClient,
-    auth_headers: dict[str, str],
+    authed_client: AuthedClient,
+    sample_agent_payload: dict[str, Any],
+) -> None:
+    """An explicit report should update total/success/failure counts and reputation ratio."""
+    registered = register_agent(authed_client, sample_agent_payload)
+
+    response = authed_client.post("/api/v1/agents/report", json={"agent_id": registered["id"], "success": False})
+    assert response.status_code == 200
+
+    body = response.json()
+    assert body["total_calls"] == 1
+    assert body["successful_calls"] == 0
+    assert body["failed_calls"] == 1
+    assert body["reputation_score"] == 0.0
+    # Report endpoint does not include latency measurements.
+    assert body["avg_latency"] == 0.0
+
+
+def test_report_batch_updates_reputation(
+    authed_client: AuthedClient,
+    db_engine: Engine,
+    db_setup: tuple[sessionmaker, Any],
     sample_agent_payload: dict[str, Any],
 ) -> None:
-    """Explicit reports should update total/success/failure counts and reputation ratio."""
-    registered = register_agent(client, auth_headers, sample_agent_payload)
+    """A batch of reports should apply every outcome and log each one in a single request."""
+    registered = register_agent(authed_client, sample_agent_payload)
+    others = [register_agent(authed_client, make_payload(name=name)) for name in ("B", "C")]
 
-    r1 = client.post("/api/v1/agents/report", headers=auth_headers, json={"agent_id": registered["id"], "success": True})
-    assert r1.status_code == 200
-    r2 = client.post("/api/v1/agents/report", headers=auth_headers, json={"agent_id": registered["id"], "success": True})
-    assert r2.status_code == 200
-    r3 = client.post("/api/v1/agents/report", headers=auth_headers, json={"agent_id": registered["id"], "success": False})
-    assert r3.status_code == 200
+    selects: list[str] = []
 
-    final_body = r3.json()
+    def record_select(conn: Any, cursor: Any, statement: str, *args: Any) -> None:
+        if statement.lstrip().upper().startswith("SELECT"):
+            selects.append(statement)
+
+    reports = [{"agent_id": registered["id"], "success": success} for success in (True, True, False)]
+    reports += [{"agent_id": other["id"], "success": True} for other in others]
+    event.listen(db_engine, "before_cursor_execute", record_select)
+    try:
+        response = authed_client.post("/api/v1/agents/report:batch", json=reports)
+    finally:
+        event.remove(db_engine, "before_cursor_execute", record_select)
+    assert response.status_code == 200
+    # One IN load before the update and one after the commit, independent of batch size.
+    assert len(selects) == 2
+
+    final_body, *other_bodies = response.json()
+    assert [body["id"] for body in other_bodies] == [other["id"] for other in others]
+    assert all(body["total_calls"] == 1 for body in other_bodies)
     assert final_body["total_calls"] == 3
     assert final_body["successful_calls"] == 2
     assert final_body["failed_calls"] == 1
     assert final_body["reputation_score"] == pytest.approx(2 / 3, rel=1e-6)
-    # Report endpoint does not include latency measurements.
     assert final_body["avg_latency"] == 0.0
 
+    db_session_factory, _ = db_setup
+    with db_session_factory() as db:
+        log_count = db.scalar(select(func.count()).select_from(CallLog).where(CallLog.agent_id == registered["id"]))
+        assert log_count == 3
+
 
 def test_delete_agent_success_removes_agent_and_logs(
-    client: TestClient,
-    auth_headers: dict[str, str],
+    authed_client: AuthedClient,
     db_setup: tuple[sessionmaker, Any],
     sample_agent_payload: dict[str, Any],
 ) -> None:
     """Deleting an agent should remove the agent record and its call logs."""
-    registered = register_agent(client, auth_headers, sample_agent_payload)
+    registered = register_agent(authed_client, sample_agent_payload)
 
     # Create one call log via report endpoint before deletion.
-    report_response = client.post(
+    report_response = authed_client.post(
         "/api/v1/agents/report",
-        headers=auth_headers,
         json={"agent_id": registered["id"], "success": True},
     )
     assert report_response.status_code == 200
 
-    delete_response = client.delete(f"/api/v1/agents/{registered['id']}", headers=auth_headers)
+    delete_response = authed_client.delete(f"/api/v1/agents/{registered['id']}")
     assert delete_response.status_code == 204
     assert delete_response.text == ""
 
@@ -340,63 +648,130 @@ def test_delete_agent_success_removes_agent_and_logs(
     with db_session_factory() as db:
         agent = db.get(Agent, registered["id"])
         assert agent is None
-        logs = db.scalars(select(CallLog).where(CallLog.agent_id == registered["id"])).all()
-        assert logs == []
+        log_count = db.scalar(select(func.count()).select_from(CallLog).where(CallLog.agent_id == registered["id"]))
+        assert log_count == 0
 
 
-def test_delete_agent_not_found_returns_404(
-    client: TestClient,
-    auth_headers: dict[str, str],
-) -> None:
-    """Deleting a missing agent id should return 404."""
-    response = client.delete("/api/v1/agents/999999", headers=auth_headers)
-    assert response.status_code == 404
-    assert response.json()["detail"] == "Agent not found."
-
-
-def test_authentication_missing_api_key_denied(
+@pytest.mark.parametrize("headers", [{}, {"X-API-Key": "wrong-key"}], ids=["missing", "invalid"])
+def test_authentication_bad_api_key_denied(
     client: TestClient,
     sample_agent_payload: dict[str, Any],
+    headers: dict[str, str],
 ) -> None:
-    """Protected endpoints should reject requests without API key."""
-    response = client.post("/api/v1/agents/register", json=sample_agent_payload)
+    """Protected endpoints should reject requests with a missing or incorrect API key."""
+    response = client.post("/api/v1/agents/register", headers=headers, json=sample_agent_payload)
     assert response.status_code == 401
     assert response.json()["detail"] == "Invalid or missing API key."
 
 
-def test_authentication_invalid_api_key_denied(
+def test_authentication_accepts_each_configured_client_key(
     client: TestClient,
-    sample_agent_payload: dict[str, Any],
+    monkeypatch: pytest.MonkeyPatch,
 ) -> None:
-    """Protected endpoints should reject incorrect API keys."""
-    response = client.post(
-        "/api/v1/agents/register",
-        headers={"X-API-Key": "wrong-key"},
-        json=sample_agent_payload,
-    )
-    assert response.status_code == 401
-    assert response.json()["detail"] == "Invalid or missing API key."
+    """Every key listed in AGENTHUB_API_KEYS should be accepted independently."""
+    monkeypatch.delenv("AGENTHUB_API_KEY", raising=False)
+    monkeypatch.setenv("AGENTHUB_API_KEYS", "client-a-key, client-b-key")
+    monkeypatch.setattr(auth, "API_KEY_DIGESTS", auth.load_api_key_digests())
+
+    for key in ("client-a-key", "client-b-key"):
+        response = client.get("/api/v1/agents/search", headers={"X-API-Key": key})
+        assert response.status_code == 200
+    assert client.get("/api/v1/agents/search", headers={"X-API-Key": "dev-secret-key"}).status_code == 401
+
+
+@pytest.mark.parametrize("backend", ["memory", "redis"])
+def test_rate_limiter_token_bucket(backend: str) -> None:
+    """The token bucket should admit exactly max_requests per key, then report a retry delay."""
+    if backend == "redis":
+        # Runs TOKEN_BUCKET_SCRIPT for real; fakeredis needs its lua extra for EVALSHA.
+        fakeredis = pytest.importorskip("fakeredis")
+
+    async def exercise() -> tuple[list[tuple[bool, int]], tuple[bool, int], tuple[bool, int]]:
+        if backend == "redis":
+            limiter = rate_limit.RedisRateLimiter(fakeredis.FakeAsyncRedis(), max_requests=3, window_seconds=60)
+        else:
+            limiter = rate_limit.InMemoryRateLimiter(max_requests=3, window_seconds=60)
+        try:
+            admitted = [await limiter.allow("client-a") for _ in range(3)]
+            denied = await limiter.allow("client-a")
+            # Buckets are per key: another client still has its full quota.
+            other_client = await limiter.allow("client-b")
+        finally:
+            await limiter.close()
+        return admitted, denied, other_client
+
+    admitted, (allowed, retry_after), other_client = asyncio.run(exercise())
+    assert admitted == [(True, 0)] * 3
+    assert allowed is False
+    assert 1 <= retry_after <= 60
+    assert other_client == (True, 0)
 
 
 def test_rate_limiting_returns_429(
-    client: TestClient,
-    auth_headers: dict[str, str],
-    monkeypatch: pytest.MonkeyPatch,
+    authed_client: AuthedClient,
+    api_key: str,
 ) -> None:
-    """When request count exceeds limit in window, endpoint should return HTTP 429."""
-    monkeypatch.setattr(
-        "agenthub.app.rate_limit.rate_limiter",
-        InMemoryRateLimiter(max_requests=2, window_seconds=60),
-    )
+    """An exhausted bucket should surface as HTTP 429 with a Retry-After header."""
+    rate_limit.rate_limiter.max_requests = 1
+    assert asyncio.run(rate_limit.rate_limiter.allow(api_key)) == (True, 0)
+
+    response = authed_client.get("/api/v1/agents/search")
+    assert response.status_code == 429
+    assert response.json()["detail"] == "Rate limit exceeded."
+    assert "Retry-After" in response.headers
+
+
+def test_upgrade_schema_backfills_latency_columns_from_old_schema() -> None:
+    """First-release databases should gain the latency columns (backfilled) and the ranking index in place."""
+    engine = create_engine("sqlite://", poolclass=StaticPool, future=True)
+    with engine.begin() as connection:
+        # Agent/CallLog tables as created by the first release, without the running latency columns.
+        connection.exec_driver_sql(
+            "CREATE TABLE agents (id INTEGER PRIMARY KEY, name VARCHAR(255) NOT NULL, skills JSON NOT NULL, "
+            "input_schema JSON NOT NULL, output_schema JSON NOT NULL, endpoint VARCHAR(500) NOT NULL, "
+            "price_per_call FLOAT NOT NULL, max_latency_ms INTEGER NOT NULL, total_calls INTEGER NOT NULL, "
+            "successful_calls INTEGER NOT NULL, failed_calls INTEGER NOT NULL, avg_latency FLOAT NOT NULL, "
+            "reputation_score FLOAT NOT NULL, created_at DATETIME NOT NULL)"
+        )
+        for column_name in ("id", "name", "price_per_call", "max_latency_ms", "reputation_score"):
+            connection.exec_driver_sql(f"CREATE INDEX ix_agents_{column_name} ON agents ({column_name})")
+        # Databases created between the two composite-index revisions also carry ix_agent_search.
+        connection.exec_driver_sql(
+            "CREATE INDEX ix_agent_search ON agents (reputation_score, price_per_call, avg_latency)"
+        )
+        connection.exec_driver_sql(
+            "CREATE TABLE call_logs (id INTEGER PRIMARY KEY, agent_id INTEGER NOT NULL REFERENCES agents (id), "
+            "timestamp DATETIME NOT NULL, latency_ms FLOAT, success BOOLEAN NOT NULL, error_message TEXT)"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO agents VALUES (1, 'A', '[]', '{}', '{}', 'http://a', 0.001, 500, 3, 2, 1, 150.0, 0.66, "
+            "'2024-01-01 00:00:00')"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO call_logs (agent_id, timestamp, latency_ms, success) VALUES "
+            "(1, '2024-01-01 00:00:00', 100.0, 1), (1, '2024-01-01 00:00:00', 200.0, 0), "
+            "(1, '2024-01-01 00:00:00', NULL, 1)"
+        )
+
+    # Same order as the app lifespan: create_all skips the existing tables, then the upgrade runs.
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+    # Idempotent: a second startup finds the columns and indexes and leaves the data alone.
+    upgrade_schema(engine)
+
+    index_names = {index["name"] for index in inspect(engine).get_indexes("agents")}
+    assert index_names == {"ix_agents_id", "ix_agents_name", "ix_agents_max_latency_ms", "ix_agent_rank"}
+    with engine.connect() as connection:
+        assert_search_uses_rank_index(connection)
 
-    # First two requests are within the allowed quota.
-    r1 = client.get("/api/v1/agents/search", headers=auth_headers)
-    r2 = client.get("/api/v1/agents/search", headers=auth_headers)
-    assert r1.status_code == 200
-    assert r2.status_code == 200
-
-    # Third request should hit the limiter.
-    r3 = client.get("/api/v1/agents/search", headers=auth_headers)
-    assert r3.status_code == 429
-    assert r3.json()["detail"] == "Rate limit exceeded."
-    assert "Retry-After" in r3.headers
+    with sessionmaker(bind=engine)() as db:
+        agent = db.get(Agent, 1)
+        assert agent is not None
+        assert agent.latency_sample_count == 2
+        assert agent.total_latency_ms == pytest.approx(300.0)
+
+        # Old tables have no server-side timestamp defaults, so inserts must still supply them.
+        db.add(Agent(**make_payload(name="B")))
+        db.add(CallLog(agent_id=1, success=True, latency_ms=50.0))
+        db.commit()
+    engine.dispose()